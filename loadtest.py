@@ -0,0 +1,494 @@
+# -*- coding: utf-8 -*-
+"""
+Load/soak test for the userbot handlers.
+
+Runs a local fake player API (instead of the onrender endpoint) and drives
+the real handlers registered in main.py with simulated Telegram users, so no
+live Telegram account is needed. Prints throughput, tail latency, event loop
+lag and memory (including user_conversations size) over time.
+
+Examples:
+    python loadtest.py --users 1000 --iterations 3
+    python loadtest.py --users 200 --duration 600 --latency 0.5 --error-rate 0.05 --cold-start 20
+    python loadtest.py --users 500 --mix cid=1 --quotas
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import logging
+import argparse
+import threading
+import tracemalloc
+from aiohttp import web
+
+# ================ FAKE PLAYER API ================
+
+def make_player_data(uid):
+    """Synthetic response shaped like get_player_personal_show"""
+    rng = random.Random(uid)
+    now = int(time.time())
+    return {
+        "basicinfo": {
+            "nickname": "Player{}".format(uid[-4:]),
+            "accountid": uid,
+            "region": "BD",
+            "accounttype": 1,
+            "level": rng.randint(1, 80),
+            "exp": rng.randint(0, 5000000),
+            "liked": rng.randint(0, 100000),
+            "createat": now - rng.randint(86400, 86400 * 2000),
+            "lastloginat": now - rng.randint(0, 86400 * 30),
+            "rank": rng.randint(1, 5000),
+            "rankingpoints": rng.randint(0, 10000),
+            "maxrank": rng.randint(1, 330),
+            "csrank": rng.randint(1, 330),
+            "csrankingpoints": rng.randint(0, 100),
+            "hipporank": rng.randint(1, 10),
+            "veteranexpiretime": now + 86400 * 30
+        },
+        "petinfo": {
+            "name": "Pet{}".format(rng.randint(1, 99)),
+            "id": rng.randint(1300000000, 1300009999),
+            "level": rng.randint(1, 7),
+            "exp": rng.randint(0, 5000),
+            "skinid": rng.randint(1310000000, 1310009999),
+            "selectedskillid": rng.randint(1315000000, 1315009999)
+        },
+        "socialinfo": {
+            "signature": "Load test signature {}".format(uid)
+        },
+        "creditscoreinfo": {
+            "creditscore": rng.randint(0, 100)
+        }
+    }
+
+def build_fake_api(options, api_stats):
+    """aiohttp app with configurable latency, errors and cold starts"""
+    state = {'last_request': None, 'warmup': None}
+
+    async def warm_up():
+        await asyncio.sleep(options.cold_start)
+
+    async def player_handler(request):
+        api_stats['requests'] += 1
+        now = time.monotonic()
+
+        # Simulate the free-tier host sleeping after being idle
+        if options.cold_start > 0:
+            idle = state['last_request'] is None or now - state['last_request'] >= options.idle_timeout
+            if idle and state['warmup'] is None:
+                api_stats['cold_starts'] += 1
+                state['warmup'] = asyncio.ensure_future(warm_up())
+            if state['warmup'] is not None:
+                await asyncio.shield(state['warmup'])
+                state['warmup'] = None
+        state['last_request'] = time.monotonic()
+
+        delay = random.gauss(options.latency, options.jitter) if options.jitter > 0 else options.latency
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        if random.random() < options.error_rate:
+            api_stats['errors'] += 1
+            return web.json_response({"error": "Injected failure"}, status=500)
+
+        return web.json_response(make_player_data(request.query.get("uid", "0")))
+
+    app = web.Application()
+    app.router.add_get('/get_player_personal_show', player_handler)
+    return app
+
+def start_fake_api(options, api_stats):
+    """Run the fake API on its own loop/thread, since main.py fetches with blocking requests"""
+    ready = threading.Event()
+
+    def run():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        runner = web.AppRunner(build_fake_api(options, api_stats))
+        loop.run_until_complete(runner.setup())
+        site = web.TCPSite(runner, '127.0.0.1', options.port)
+        loop.run_until_complete(site.start())
+        ready.set()
+        loop.run_forever()
+
+    api_thread = threading.Thread(target=run)
+    api_thread.daemon = True
+    api_thread.start()
+    ready.wait()
+
+# ================ ENVIRONMENT ================
+
+def prepare_environment(options):
+    """Environment main.py needs at import time, pointed at the fake API"""
+    from telethon.sessions import StringSession
+    from telethon.crypto import AuthKey
+
+    # A well-formed but unused session, the client never connects
+    session = StringSession()
+    session.set_dc(2, '127.0.0.1', 443)
+    session.auth_key = AuthKey(bytes(256))
+
+    os.environ["API_ID"] = "1"
+    os.environ["API_HASH"] = "loadtest"
+    os.environ["SESSION_STRING"] = session.save()
+    os.environ["PLAYER_API_URL"] = "http://127.0.0.1:{}".format(options.port)
+
+    if not options.quotas:
+        os.environ["QUOTA_USER"] = ""
+        os.environ["QUOTA_CHAT"] = ""
+        os.environ["COMMAND_QUOTAS"] = ""
+        os.environ["DEDUPE_WINDOW"] = "0"
+
+# ================ FAKE TELEGRAM ================
+
+OWNER_ID = 1000
+FIRST_USER_ID = 100000
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+        self.first_name = "LoadTest"
+        self.last_name = None
+        self.username = None
+        self.phone = None
+        self.bot = False
+
+class FakeMessage:
+    def __init__(self, chat_id, text, replies):
+        self.chat_id = chat_id
+        self.text = text
+        self.replies = replies
+
+    async def edit(self, text=None, **kwargs):
+        self.text = text
+        self.replies.append(text or "")
+        return self
+
+    async def delete(self):
+        return None
+
+class FakeEvent:
+    """The subset of telethon's NewMessage.Event the handlers use"""
+    def __init__(self, user_id, text):
+        self.sender_id = user_id
+        self.chat_id = user_id
+        self.is_private = True
+        self.pattern_match = None
+        self.replies = []
+        self.message = FakeMessage(user_id, text, self.replies)
+
+    async def reply(self, message=None, **kwargs):
+        self.replies.append(message or "")
+        return FakeMessage(self.chat_id, message, self.replies)
+
+    async def get_chat(self):
+        return FakeUser(self.chat_id)
+
+def install_fake_client(bot, stats):
+    """Replace the network calls the handlers make on the shared client"""
+    owner = FakeUser(OWNER_ID)
+
+    async def get_me(input_peer=False):
+        return owner
+
+    async def get_entity(entity):
+        return FakeUser(entity)
+
+    async def send_message(entity, message=None, **kwargs):
+        stats['receipts'] += 1
+        return FakeMessage(entity, message, [])
+
+    bot.bot_owner_id = OWNER_ID
+    bot.client.get_me = get_me
+    bot.client.get_entity = get_entity
+    bot.client.send_message = send_message
+
+async def dispatch(bot, handlers, user_id, text):
+    """Feed one incoming message through the registered handlers, like telethon does"""
+    event = FakeEvent(user_id, text)
+    for callback, builder in handlers:
+        pattern = getattr(builder, 'pattern', None)
+        if pattern:
+            match = pattern(text)
+            if not match:
+                continue
+            event.pattern_match = match
+        else:
+            event.pattern_match = None
+        await callback(event)
+    return event.replies
+
+# ================ SIMULATED USERS ================
+
+def build_flows(uid):
+    """Messages sent for each flow type"""
+    return {
+        'cid': [".Cid {}".format(uid)],
+        'tp': [
+            ".tp {}".format(uid), "y", "UNIPIN-{}".format(uid), "TRX{}".format(uid),
+            "Weekly", "150", "/gen", "y"
+        ],
+        'gor': [
+            ".gor", uid, "Diamonds via ID", "TRX{}".format(uid), "Monthly", "700", "/gen"
+        ]
+    }
+
+def parse_mix(spec):
+    """Parse "cid=6,tp=3,gor=1" into weighted choices"""
+    names = []
+    weights = []
+    for item in spec.split(","):
+        name, weight = item.split("=")
+        names.append(name.strip().lower())
+        weights.append(float(weight))
+    return names, weights
+
+def record(stats, name, latency, failed):
+    stats['latencies'].setdefault(name, []).append(latency)
+    # Interval samples track per-message latency, which is what users feel
+    if name.startswith("step:"):
+        stats['window'].append(latency)
+    if failed:
+        stats['errors'][name] = stats['errors'].get(name, 0) + 1
+
+async def send_at(bot, handlers, user_id, text, send_time):
+    """Send a message at its intended time and measure latency from that time.
+
+    If the loop was blocked, the send happens late, and that wait counts toward
+    latency, avoiding coordinated omission."""
+    delay = send_time - time.monotonic()
+    if delay > 0:
+        await asyncio.sleep(delay)
+    try:
+        replies = await dispatch(bot, handlers, user_id, text)
+    except Exception as e:
+        logging.error("Dispatch Error: {}".format(e))
+        replies = ["Error: {}".format(e)]
+    return replies, time.monotonic()
+
+async def simulate_user(bot, handlers, options, stats, index, started, deadline):
+    user_id = FIRST_USER_ID + index
+    names, weights = parse_mix(options.mix)
+
+    # Ramp users in instead of starting them all at once
+    send_time = started + options.ramp * index / options.users
+
+    iteration = 0
+    while True:
+        if deadline is not None:
+            if time.monotonic() >= deadline:
+                break
+        elif iteration >= options.iterations:
+            break
+        iteration += 1
+
+        flow = random.choices(names, weights)[0]
+        uid = str(random.randint(1000000000, 9999999999))
+        flow_start = send_time
+        failed = False
+
+        for text in build_flows(uid)[flow]:
+            replies, answered = await send_at(bot, handlers, user_id, text, send_time)
+
+            step_failed = any("Error" in reply or "❌" in reply or "Slow down" in reply for reply in replies)
+            record(stats, "step:" + flow, answered - send_time, step_failed)
+
+            # The user replies think-time after seeing the answer, whether or not the loop is free then
+            send_time = answered
+            if step_failed:
+                failed = True
+                break
+            if options.think_time > 0:
+                send_time += random.uniform(0, options.think_time)
+
+        stats['flows'] += 1
+        record(stats, "flow:" + flow, answered - flow_start, failed)
+
+        # Abandoned conversations stay in user_conversations, like real users walking away
+        if failed and random.random() < options.abandon_rate:
+            continue
+        bot.user_conversations.pop(user_id, None)
+
+# ================ REPORTING ================
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+def process_rss_mb(pid):
+    """Resident memory of a process from /proc, 0 when unavailable"""
+    try:
+        with open("/proc/{}/status".format(pid)) as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    return 0.0
+
+def render_pool_rss_mb(bot):
+    """Resident memory of the render pool workers"""
+    pool = bot.render_pool
+    if pool is None or not pool._processes:
+        return 0.0
+    return sum(process_rss_mb(pid) for pid in list(pool._processes))
+
+def current_rss_mb():
+    """Current resident memory, from /proc when available"""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+async def sample_metrics(bot, options, stats, api_stats, started):
+    """Periodic throughput/latency/memory samples"""
+    last_flows = 0
+    last_sample = started
+    header = "{:>8} {:>8} {:>9} {:>8} {:>8} {:>8} {:>9} {:>8} {:>8} {:>8} {:>7}".format(
+        "elapsed", "flows", "flows/s", "p50 ms", "p95 ms", "p99 ms", "lag ms", "rss MB", "pool MB", "py MB", "convs")
+    print(header)
+
+    while True:
+        tick = time.monotonic()
+        await asyncio.sleep(options.sample_interval)
+        # How late the sampler woke up, i.e. how long the loop was blocked
+        lag = time.monotonic() - tick - options.sample_interval
+        stats['max_lag'] = max(stats['max_lag'], lag)
+
+        now = time.monotonic()
+        window = stats['window']
+        stats['window'] = []
+        flows = stats['flows']
+        traced = tracemalloc.get_traced_memory()[0] / (1024.0 * 1024.0) if tracemalloc.is_tracing() else 0.0
+
+        sample = {
+            'elapsed': now - started,
+            'flows': flows,
+            # Divide by the real interval, the sampler wakes up late when the loop is blocked
+            'throughput': (flows - last_flows) / (now - last_sample),
+            'p50': percentile(window, 50) * 1000,
+            'p95': percentile(window, 95) * 1000,
+            'p99': percentile(window, 99) * 1000,
+            'lag': lag * 1000,
+            'rss': current_rss_mb(),
+            'pool_rss': render_pool_rss_mb(bot),
+            'traced': traced,
+            'conversations': len(bot.user_conversations)
+        }
+        stats['samples'].append(sample)
+        last_flows = flows
+        last_sample = now
+
+        print("{elapsed:>8.1f} {flows:>8} {throughput:>9.1f} {p50:>8.0f} {p95:>8.0f} {p99:>8.0f} {lag:>9.0f} {rss:>8.1f} {pool_rss:>8.1f} {traced:>8.1f} {conversations:>7}".format(**sample))
+        sys.stdout.flush()
+
+def print_report(bot, stats, api_stats, elapsed):
+    lines = []
+    lines.append("")
+    lines.append("═══════════════════════════════")
+    lines.append("Load Test Report")
+    lines.append("═══════════════════════════════")
+    lines.append("Duration: {:.1f}s".format(elapsed))
+    lines.append("Flows: {} ({:.1f}/s)".format(stats['flows'], stats['flows'] / elapsed if elapsed else 0))
+    lines.append("Receipts sent: {}".format(stats['receipts']))
+    lines.append("API requests: {} (errors: {}, cold starts: {})".format(
+        api_stats['requests'], api_stats['errors'], api_stats['cold_starts']))
+    lines.append("Max event loop lag: {:.0f} ms".format(stats['max_lag'] * 1000))
+    lines.append("Leftover conversations: {}".format(len(bot.user_conversations)))
+    if stats['samples']:
+        lines.append("RSS: {:.1f} MB → {:.1f} MB (peak {:.1f} MB)".format(
+            stats['samples'][0]['rss'], stats['samples'][-1]['rss'], max(s['rss'] for s in stats['samples'])))
+        lines.append("Render pool RSS: peak {:.1f} MB".format(max(s['pool_rss'] for s in stats['samples'])))
+    lines.append("")
+    lines.append("{:<12} {:>8} {:>7} {:>8} {:>8} {:>8} {:>8}".format("name", "count", "errors", "p50 ms", "p95 ms", "p99 ms", "max ms"))
+    for name in sorted(stats['latencies']):
+        values = stats['latencies'][name]
+        lines.append("{:<12} {:>8} {:>7} {:>8.0f} {:>8.0f} {:>8.0f} {:>8.0f}".format(
+            name, len(values), stats['errors'].get(name, 0),
+            percentile(values, 50) * 1000, percentile(values, 95) * 1000,
+            percentile(values, 99) * 1000, max(values) * 1000))
+    print("\n".join(lines))
+
+# ================ MAIN ================
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load/soak test the userbot handlers without Telegram")
+    parser.add_argument("--users", type=int, default=100, help="Simulated users running concurrently")
+    parser.add_argument("--iterations", type=int, default=3, help="Flows per user (ignored with --duration)")
+    parser.add_argument("--duration", type=float, default=None, help="Soak for this many seconds instead of a fixed number of flows")
+    parser.add_argument("--mix", default="cid=6,tp=3,gor=1", help="Weighted flow mix")
+    parser.add_argument("--ramp", type=float, default=5.0, help="Seconds to spread user start-up over")
+    parser.add_argument("--think-time", type=float, default=0.5, help="Max seconds a user waits between conversation steps")
+    parser.add_argument("--abandon-rate", type=float, default=0.0, help="Chance a failed flow is left in user_conversations")
+    parser.add_argument("--latency", type=float, default=0.2, help="Fake API mean latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.05, help="Fake API latency standard deviation")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fake API HTTP 500 rate (0-1)")
+    parser.add_argument("--cold-start", type=float, default=0.0, help="Fake API cold start delay in seconds")
+    parser.add_argument("--idle-timeout", type=float, default=30.0, help="Idle seconds before the fake API goes cold again")
+    parser.add_argument("--port", type=int, default=8799, help="Fake API port")
+    parser.add_argument("--sample-interval", type=float, default=5.0, help="Seconds between metric samples")
+    parser.add_argument("--quotas", action="store_true", help="Keep the bot's quotas and dedupe enabled")
+    parser.add_argument("--tracemalloc", action="store_true", help="Track Python heap size (slower)")
+    return parser.parse_args()
+
+async def run_load_test(bot, options, api_stats):
+    stats = {
+        'flows': 0,
+        'receipts': 0,
+        'latencies': {},
+        'errors': {},
+        'window': [],
+        'samples': [],
+        'max_lag': 0.0
+    }
+    install_fake_client(bot, stats)
+    handlers = bot.client.list_event_handlers()
+
+    # Simulated users are private-chat authorized users
+    # A set, so the membership check in is_authorized doesn't grow with --users
+    bot.authorized_user_ids = set(bot.authorized_user_ids) | set(range(FIRST_USER_ID, FIRST_USER_ID + options.users))
+
+    started = time.monotonic()
+    deadline = started + options.duration if options.duration else None
+    sampler = asyncio.ensure_future(sample_metrics(bot, options, stats, api_stats, started))
+
+    await asyncio.gather(*[
+        simulate_user(bot, handlers, options, stats, index, started, deadline) for index in range(options.users)
+    ])
+
+    sampler.cancel()
+    print_report(bot, stats, api_stats, time.monotonic() - started)
+
+def main():
+    options = parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    if options.tracemalloc:
+        tracemalloc.start()
+
+    api_stats = {'requests': 0, 'errors': 0, 'cold_starts': 0}
+    start_fake_api(options, api_stats)
+    prepare_environment(options)
+
+    # Import after the environment is set, main.py reads it at import time
+    import main as bot
+    logging.getLogger().setLevel(logging.WARNING)
+
+    try:
+        asyncio.run(run_load_test(bot, options, api_stats))
+    except KeyboardInterrupt:
+        logging.warning("Load test stopped")
+
+if __name__ == "__main__":
+    main()
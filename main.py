@@ -1,15 +1,26 @@
 # -*- coding: utf-8 -*-
 import os
 import sys
+import io
+import csv
+import json
+import hashlib
 import asyncio
 import logging
 import random
 import string
+import time
+import multiprocessing
+from collections import deque, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime, timedelta
 from flask import Flask
 from threading import Thread
+from PIL import Image, ImageDraw, ImageFont, ImageOps
 from telethon import TelegramClient, events, Button
 from telethon.sessions import StringSession
+from telethon.errors import AuthKeyError, UnauthorizedError
 import requests
 
 # Configure encoding
@@ -32,6 +43,34 @@ AUTHORIZED_USERS = os.environ.get("AUTHORIZED_USERS", "")  # Comma-separated use
 AUTHORIZED_GROUPS = os.environ.get("AUTHORIZED_GROUPS", "")  # Comma-separated group chat IDs
 RECEIPT_CHAT_ID = int(os.environ.get("RECEIPT_CHAT_ID", "-5065485406"))
 TOPUP_LINK = os.environ.get("TOPUP_LINK", "https://example.com/topup")  # Topup link for .tp command
+PLAYER_API_URL = os.environ.get("PLAYER_API_URL", "https://freefire-api-2-e4j5.onrender.com").rstrip("/")  # Player info API
+
+# Reconnect supervisor settings (seconds)
+RECONNECT_BASE_DELAY = float(os.environ.get("RECONNECT_BASE_DELAY", "1"))
+RECONNECT_MAX_DELAY = float(os.environ.get("RECONNECT_MAX_DELAY", "300"))
+RECONNECT_STABLE_AFTER = float(os.environ.get("RECONNECT_STABLE_AFTER", "60"))  # Uptime before backoff resets
+
+# Batch rendering/export settings
+RENDER_WORKERS = int(os.environ.get("RENDER_WORKERS", "2"))  # Process pool size for heavy rendering
+BATCH_MAX_UIDS = int(os.environ.get("BATCH_MAX_UIDS", "500"))  # Max UIDs per .bcid request
+BATCH_CHUNK_SIZE = int(os.environ.get("BATCH_CHUNK_SIZE", "25"))  # UIDs fetched/rendered per step
+PROGRESS_EDIT_INTERVAL = float(os.environ.get("PROGRESS_EDIT_INTERVAL", "3"))  # Min seconds between progress edits
+RECEIPT_HISTORY_LIMIT = int(os.environ.get("RECEIPT_HISTORY_LIMIT", "5000"))  # Receipts kept for .export
+
+# Command quotas, as "burst/seconds" (empty or 0 disables a quota)
+QUOTA_USER = os.environ.get("QUOTA_USER", "20/60")  # All commands per user
+QUOTA_CHAT = os.environ.get("QUOTA_CHAT", "60/60")  # All commands per chat
+COMMAND_QUOTAS = os.environ.get("COMMAND_QUOTAS", "cid=5/60,card=5/60,bcid=2/300,export=2/300,tp=5/60,gor=5/60")  # Per user per command
+DEDUPE_WINDOW = float(os.environ.get("DEDUPE_WINDOW", "10"))  # Seconds to collapse identical commands in a chat
+QUOTA_NOTICE_INTERVAL = float(os.environ.get("QUOTA_NOTICE_INTERVAL", "30"))  # Min seconds between "slow down" replies per user
+
+# Image card settings
+CARD_FONT_PATH = os.environ.get("CARD_FONT_PATH", "DejaVuSans.ttf")  # TTF font for card text
+CARD_BOLD_FONT_PATH = os.environ.get("CARD_BOLD_FONT_PATH", "DejaVuSans-Bold.ttf")  # TTF font for card headings
+CARD_BACKGROUND_PATH = os.environ.get("CARD_BACKGROUND_PATH", "")  # Optional background image (gradient if unset)
+CARD_ICONS_DIR = os.environ.get("CARD_ICONS_DIR", "")  # Optional dir of <name>.png icons (drawn badges if unset)
+CARD_CACHE_SIZE = int(os.environ.get("CARD_CACHE_SIZE", "200"))  # Rendered profile cards kept in memory
+RECEIPT_CARDS = os.environ.get("RECEIPT_CARDS", "1") == "1"  # Send a receipt card after each order
 
 # Parse authorized users
 authorized_user_ids = []
@@ -49,6 +88,31 @@ if AUTHORIZED_GROUPS:
     except:
         logging.warning("Error parsing AUTHORIZED_GROUPS")
 
+def parse_quota(spec):
+    """Parse "burst/seconds" into (capacity, refill per second), or None if disabled"""
+    try:
+        burst, seconds = spec.split("/")
+        burst = float(burst)
+        seconds = float(seconds)
+        if burst <= 0 or seconds <= 0:
+            return None
+        return (burst, burst / seconds)
+    except:
+        if spec.strip() and spec.strip() != "0":
+            logging.warning("Error parsing quota: {}".format(spec))
+        return None
+
+# Parse quotas
+user_quota = parse_quota(QUOTA_USER)
+chat_quota = parse_quota(QUOTA_CHAT)
+command_quotas = {}
+for item in COMMAND_QUOTAS.split(","):
+    if "=" in item:
+        name, spec = item.split("=", 1)
+        quota = parse_quota(spec)
+        if quota:
+            command_quotas[name.strip().lower()] = quota
+
 # Validate environment variables
 if not API_ID or API_ID == 0:
     logging.error("API_ID is not set! Please set it in environment variables.")
@@ -63,7 +127,50 @@ if not SESSION_STRING:
     sys.exit(1)
 
 # Initialize Telethon with StringSession
-client = TelegramClient(StringSession(SESSION_STRING), API_ID, API_HASH)
+# catch_up makes Telethon replay updates missed while disconnected on every connect.
+# auto_reconnect is off so every drop goes through run_supervised (backoff + metrics).
+client = TelegramClient(StringSession(SESSION_STRING), API_ID, API_HASH, catch_up=True, auto_reconnect=False)
+
+# Connection metrics (exposed on /metrics)
+connection_metrics = {
+    'reconnect_count': 0,
+    'disconnect_count': 0,
+    'disconnected_seconds': 0.0,
+    'disconnected_since': None,
+    'last_disconnect_reason': None,
+    'last_reconnect_at': None
+}
+
+def mark_disconnected(reason):
+    """Record the start of a disconnect window"""
+    if connection_metrics['disconnected_since'] is None:
+        connection_metrics['disconnected_since'] = time.monotonic()
+        connection_metrics['disconnect_count'] += 1
+    connection_metrics['last_disconnect_reason'] = str(reason)
+
+def mark_reconnected():
+    """Close the current disconnect window and count the reconnect"""
+    since = connection_metrics['disconnected_since']
+    if since is not None:
+        connection_metrics['disconnected_seconds'] += time.monotonic() - since
+        connection_metrics['disconnected_since'] = None
+        connection_metrics['reconnect_count'] += 1
+        connection_metrics['last_reconnect_at'] = get_bd_time()
+
+def get_connection_metrics():
+    """Snapshot of connection metrics, including an ongoing disconnect"""
+    since = connection_metrics['disconnected_since']
+    disconnected_seconds = connection_metrics['disconnected_seconds']
+    if since is not None:
+        disconnected_seconds += time.monotonic() - since
+    return {
+        'connected': since is None and client.is_connected(),
+        'reconnect_count': connection_metrics['reconnect_count'],
+        'disconnect_count': connection_metrics['disconnect_count'],
+        'disconnected_seconds': round(disconnected_seconds, 3),
+        'last_disconnect_reason': connection_metrics['last_disconnect_reason'],
+        'last_reconnect_at': connection_metrics['last_reconnect_at']
+    }
 
 # Flask app
 app = Flask(__name__)
@@ -76,6 +183,16 @@ def home():
 def health():
     return {"status": "alive", "bot": "running"}
 
+@app.route('/metrics')
+def metrics():
+    data = get_connection_metrics()
+    data['quota_rejected'] = quota_metrics['rejected']
+    data['quota_deduped'] = quota_metrics['deduped']
+    data['card_cache_hits'] = card_metrics['hits']
+    data['card_renders'] = card_metrics['renders']
+    data['card_uploads_reused'] = card_metrics['uploads_reused']
+    return data
+
 def run_flask():
     port = int(os.environ.get("PORT", 5000))
     app.run(host='0.0.0.0', port=port, debug=False, use_reloader=False)
@@ -87,6 +204,13 @@ def unix_to_date(timestamp):
     except:
         return str(timestamp)
 
+def unix_to_short_date(timestamp):
+    try:
+        timestamp = int(timestamp)
+        return datetime.fromtimestamp(timestamp).strftime('%d %b %Y')
+    except:
+        return str(timestamp)
+
 def format_number(num):
     try:
         return "{:,}".format(int(num))
@@ -118,7 +242,7 @@ def generate_order_id(length=8):
 
 def fetch_player_data(uid, server="bd"):
     try:
-        url = "https://freefire-api-2-e4j5.onrender.com/get_player_personal_show?server={}&uid={}".format(server, uid)
+        url = "{}/get_player_personal_show?server={}&uid={}".format(PLAYER_API_URL, server, uid)
         response = requests.get(url, timeout=10)
         response.raise_for_status()
         return response.json()
@@ -287,15 +411,380 @@ def format_gor_receipt(order_data):
     lines.append("```")
     return "\n".join(lines)
 
+# ================ BATCH RENDERING ================
+# These run inside the render pool, so they must stay top-level and picklable.
+
+RECEIPT_CSV_FIELDS = [
+    'type', 'order_id', 'uid', 'player_name', 'package_name', 'order_details',
+    'unipin_code', 'bkash_trx', 'paid_amount', 'datetime'
+]
+
+def render_profiles_chunk(profiles):
+    """Render a list of player data dicts as plain text (no code fences)"""
+    blocks = []
+    for data in profiles:
+        blocks.append(format_player_profile(data).strip("`\n"))
+    return "\n\n".join(blocks)
+
+def build_receipts_csv(receipts):
+    """Build a CSV export of stored receipts"""
+    output = io.StringIO()
+    writer = csv.DictWriter(output, fieldnames=RECEIPT_CSV_FIELDS, extrasaction='ignore')
+    writer.writeheader()
+    for receipt in receipts:
+        writer.writerow(receipt)
+    return output.getvalue().encode('utf-8')
+
+def build_receipts_report(receipts):
+    """Build a plain text report of stored receipts"""
+    blocks = []
+    for receipt in receipts:
+        if receipt.get('type') == 'gor':
+            text = format_gor_receipt(receipt)
+        else:
+            text = format_order_receipt(receipt)
+        blocks.append(text.strip("`\n"))
+    
+    lines = []
+    lines.append("Receipts Report")
+    lines.append("Generated: {}".format(get_bd_time()))
+    lines.append("Total Orders: {}".format(len(receipts)))
+    lines.append("")
+    lines.append("\n\n".join(blocks))
+    return "\n".join(lines).encode('utf-8')
+
+# Render pool (created lazily on first heavy job)
+render_pool = None
+
+def get_render_pool():
+    global render_pool
+    if render_pool is None:
+        # Don't fork: workers would inherit the Telegram/Flask sockets and any locks held by other threads
+        start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        render_pool = ProcessPoolExecutor(max_workers=RENDER_WORKERS, mp_context=multiprocessing.get_context(start_method))
+    return render_pool
+
+def reset_render_pool(pool):
+    """Drop a broken pool so the next job starts fresh workers"""
+    global render_pool
+    if render_pool is pool:
+        render_pool = None
+        pool.shutdown(wait=False)
+
+async def run_in_render_pool(func, *args):
+    """Run CPU-bound rendering off the event loop, restarting the pool once if a worker died"""
+    loop = asyncio.get_running_loop()
+    pool = get_render_pool()
+    try:
+        return await loop.run_in_executor(pool, func, *args)
+    except BrokenProcessPool:
+        logging.warning("Render pool broken, restarting it")
+        reset_render_pool(pool)
+        return await loop.run_in_executor(get_render_pool(), func, *args)
+
+async def edit_progress(message, text):
+    """Edit a progress message, ignoring edit failures"""
+    try:
+        await message.edit(text)
+    except Exception as e:
+        logging.warning("Progress Edit Error: {}".format(e))
+
+def make_document(data, filename):
+    """Wrap bytes in a named file object for upload"""
+    document = io.BytesIO(data)
+    document.name = filename
+    return document
+
+# ================ IMAGE CARDS ================
+# Rendering runs in the render pool. Assets are loaded once per worker process and reused.
+
+CARD_WIDTH = 900
+CARD_PADDING = 40
+CARD_TEXT_COLOR = (255, 255, 255)
+CARD_MUTED_COLOR = (170, 180, 200)
+CARD_PANEL_COLOR = (255, 255, 255, 28)
+CARD_GRADIENT = ((24, 28, 48), (58, 20, 64))
+
+TIER_COLORS = {
+    "Heroic": (220, 60, 60),
+    "Diamond": (150, 90, 230),
+    "Platinum": (70, 190, 210),
+    "Gold": (230, 180, 50),
+    "Silver/Bronze": (150, 150, 160),
+    "N/A": (110, 110, 120)
+}
+
+ICON_COLORS = {
+    "level": (90, 160, 250),
+    "likes": (240, 80, 120),
+    "credit": (80, 200, 120),
+    "rank": (230, 180, 50),
+    "points": (250, 140, 60),
+    "cs": (200, 90, 220),
+    "pet": (120, 200, 200),
+    "created": (150, 150, 230),
+    "login": (100, 210, 160),
+    "order": (90, 160, 250),
+    "uid": (150, 150, 230),
+    "player": (120, 200, 200),
+    "package": (230, 180, 50),
+    "paid": (80, 200, 120),
+    "details": (200, 90, 220),
+    "date": (100, 210, 160)
+}
+
+# Per-process asset cache: fonts, backgrounds and icons
+card_assets = {}
+
+def get_card_font(size, bold=False):
+    key = ('font', size, bold)
+    if key not in card_assets:
+        path = CARD_BOLD_FONT_PATH if bold else CARD_FONT_PATH
+        try:
+            card_assets[key] = ImageFont.truetype(path, size)
+        except OSError:
+            logging.warning("Card font not found: {}".format(path))
+            try:
+                card_assets[key] = ImageFont.load_default(size)
+            except TypeError:
+                card_assets[key] = ImageFont.load_default()
+    return card_assets[key]
+
+def get_card_background(width, height):
+    key = ('background', width, height)
+    if key not in card_assets:
+        background = None
+        if CARD_BACKGROUND_PATH:
+            try:
+                background = ImageOps.fit(Image.open(CARD_BACKGROUND_PATH).convert('RGB'), (width, height))
+            except OSError as e:
+                logging.warning("Card background error: {}".format(e))
+        if background is None:
+            gradient = Image.linear_gradient('L').resize((width, height))
+            background = ImageOps.colorize(gradient, CARD_GRADIENT[0], CARD_GRADIENT[1])
+        card_assets[key] = background.convert('RGBA')
+    return card_assets[key]
+
+def get_card_icon(name, size):
+    key = ('icon', name, size)
+    if key not in card_assets:
+        icon = None
+        if CARD_ICONS_DIR:
+            path = os.path.join(CARD_ICONS_DIR, name + ".png")
+            if os.path.exists(path):
+                icon = Image.open(path).convert('RGBA').resize((size, size))
+        if icon is None:
+            icon = Image.new('RGBA', (size, size), (0, 0, 0, 0))
+            draw = ImageDraw.Draw(icon)
+            draw.ellipse((0, 0, size - 1, size - 1), fill=ICON_COLORS.get(name, CARD_MUTED_COLOR))
+            letter = name[0].upper()
+            font = get_card_font(size // 2, bold=True)
+            draw.text((size / 2, size / 2), letter, font=font, fill=CARD_TEXT_COLOR, anchor='mm')
+        card_assets[key] = icon
+    return card_assets[key]
+
+def fit_text(draw, text, font, max_width):
+    """Trim text with an ellipsis so it fits max_width"""
+    text = str(text)
+    if draw.textlength(text, font=font) <= max_width:
+        return text
+    while text and draw.textlength(text + "…", font=font) > max_width:
+        text = text[:-1]
+    return text + "…"
+
+def new_card(height):
+    card = get_card_background(CARD_WIDTH, height).copy()
+    overlay = Image.new('RGBA', card.size, (0, 0, 0, 0))
+    return card, overlay, ImageDraw.Draw(overlay)
+
+def finish_card(card, overlay):
+    """Flatten the card and encode it as PNG bytes"""
+    card.alpha_composite(overlay)
+    output = io.BytesIO()
+    card.convert('RGB').save(output, format='PNG', optimize=False)
+    return output.getvalue()
+
+def draw_stat_cell(overlay, draw, box, icon_name, label, value):
+    left, top, right, bottom = box
+    draw.rounded_rectangle(box, radius=14, fill=CARD_PANEL_COLOR)
+    icon_size = 40
+    icon_top = top + (bottom - top - icon_size) // 2
+    overlay.alpha_composite(get_card_icon(icon_name, icon_size), (left + 14, icon_top))
+    text_left = left + 14 + icon_size + 12
+    max_width = right - text_left - 10
+    draw.text((text_left, top + 16), fit_text(draw, label, get_card_font(17), max_width), font=get_card_font(17), fill=CARD_MUTED_COLOR)
+    draw.text((text_left, top + 42), fit_text(draw, value, get_card_font(24, bold=True), max_width), font=get_card_font(24, bold=True), fill=CARD_TEXT_COLOR)
+
+def render_profile_card(data):
+    """Render a player profile card as PNG bytes"""
+    basic = data.get("basicinfo", {})
+    pet = data.get("petinfo", {})
+    social = data.get("socialinfo", {})
+    credit = data.get("creditscoreinfo", {})
+    
+    br_rank = basic.get("rank", "N/A")
+    rank_tier = get_rank_tier(int(br_rank)) if br_rank != "N/A" else "N/A"
+    region = basic.get("region", "N/A")
+    
+    card, overlay, draw = new_card(660)
+    content_width = CARD_WIDTH - CARD_PADDING * 2
+    
+    # Header: nickname, UID/region and rank tier badge
+    badge_font = get_card_font(22, bold=True)
+    badge_width = int(draw.textlength(rank_tier, font=badge_font)) + 40
+    badge_left = CARD_WIDTH - CARD_PADDING - badge_width
+    draw.rounded_rectangle((badge_left, 48, badge_left + badge_width, 92), radius=22, fill=TIER_COLORS.get(rank_tier, TIER_COLORS["N/A"]))
+    draw.text((badge_left + badge_width / 2, 70), rank_tier, font=badge_font, fill=CARD_TEXT_COLOR, anchor='mm')
+    
+    name_font = get_card_font(44, bold=True)
+    draw.text((CARD_PADDING, 40), fit_text(draw, basic.get("nickname", "N/A"), name_font, badge_left - CARD_PADDING - 20), font=name_font, fill=CARD_TEXT_COLOR)
+    subtitle = "UID {}  •  {}  •  Level {}".format(basic.get("accountid", "N/A"), "Bangladesh" if region == "BD" else region, basic.get("level", "N/A"))
+    draw.text((CARD_PADDING, 104), fit_text(draw, subtitle, get_card_font(22), content_width), font=get_card_font(22), fill=CARD_MUTED_COLOR)
+    
+    # Stats grid, 3 x 3
+    stats = [
+        ("level", "Level", basic.get("level", "N/A")),
+        ("likes", "Likes", format_number(basic.get("liked", 0))),
+        ("credit", "Credit Score", "{}/100".format(credit.get("creditscore", "N/A"))),
+        ("rank", "BR Rank", br_rank),
+        ("points", "Ranking Points", format_number(basic.get("rankingpoints", 0))),
+        ("cs", "CS Rank", basic.get("csrank", "N/A")),
+        ("pet", "Pet", "{} Lv.{}".format(pet.get("name", "N/A"), pet.get("level", "N/A"))),
+        ("created", "Created On", unix_to_short_date(basic.get("createat", "N/A"))),
+        ("login", "Last Login", unix_to_short_date(basic.get("lastloginat", "N/A")))
+    ]
+    gap = 16
+    cell_width = (content_width - gap * 2) // 3
+    cell_height = 94
+    grid_top = 160
+    for index, (icon_name, label, value) in enumerate(stats):
+        row, column = divmod(index, 3)
+        left = CARD_PADDING + column * (cell_width + gap)
+        top = grid_top + row * (cell_height + gap)
+        draw_stat_cell(overlay, draw, (left, top, left + cell_width, top + cell_height), icon_name, label, value)
+    
+    # Signature and footer
+    signature_top = grid_top + 3 * (cell_height + gap) + 10
+    draw.rounded_rectangle((CARD_PADDING, signature_top, CARD_WIDTH - CARD_PADDING, signature_top + 64), radius=14, fill=CARD_PANEL_COLOR)
+    signature = "\"{}\"".format(social.get("signature", "N/A"))
+    draw.text((CARD_PADDING + 20, signature_top + 32), fit_text(draw, signature, get_card_font(22), content_width - 40), font=get_card_font(22), fill=CARD_TEXT_COLOR, anchor='lm')
+    draw.text((CARD_WIDTH / 2, 630), "Powered by As Top up BD", font=get_card_font(18), fill=CARD_MUTED_COLOR, anchor='mm')
+    
+    return finish_card(card, overlay)
+
+def render_receipt_card(order_data):
+    """Render a shareable receipt card as PNG bytes (no UniPin code or bKash Trx ID)"""
+    rows = [
+        ("order", "Order ID", order_data.get('order_id', 'N/A')),
+        ("uid", "UID", order_data.get('uid', 'N/A')),
+        ("player", "Player Name", order_data.get('player_name', 'N/A')),
+        ("package", "Package Name", order_data.get('package_name', 'N/A'))
+    ]
+    if order_data.get('order_details'):
+        rows.append(("details", "Order Details", order_data['order_details']))
+    rows.append(("paid", "Paid/Profit", order_data.get('paid_amount', 'N/A')))
+    rows.append(("date", "Date & Time", order_data.get('datetime', get_bd_time())))
+    
+    row_height = 58
+    rows_top = 130
+    height = rows_top + len(rows) * row_height + 80
+    card, overlay, draw = new_card(height)
+    content_width = CARD_WIDTH - CARD_PADDING * 2
+    
+    draw.text((CARD_WIDTH / 2, 62), "ORDER RECEIPT", font=get_card_font(40, bold=True), fill=CARD_TEXT_COLOR, anchor='mm')
+    draw.line((CARD_PADDING, 104, CARD_WIDTH - CARD_PADDING, 104), fill=CARD_MUTED_COLOR, width=2)
+    
+    label_font = get_card_font(22)
+    value_font = get_card_font(24, bold=True)
+    for index, (icon_name, label, value) in enumerate(rows):
+        top = rows_top + index * row_height
+        if index % 2 == 0:
+            draw.rounded_rectangle((CARD_PADDING, top, CARD_WIDTH - CARD_PADDING, top + row_height - 6), radius=12, fill=CARD_PANEL_COLOR)
+        middle = top + (row_height - 6) // 2
+        overlay.alpha_composite(get_card_icon(icon_name, 32), (CARD_PADDING + 14, middle - 16))
+        draw.text((CARD_PADDING + 60, middle), label, font=label_font, fill=CARD_MUTED_COLOR, anchor='lm')
+        value_left = CARD_PADDING + 280
+        draw.text((value_left, middle), fit_text(draw, value, value_font, CARD_PADDING + content_width - value_left - 14), font=value_font, fill=CARD_TEXT_COLOR, anchor='lm')
+    
+    draw.text((CARD_WIDTH / 2, height - 36), "Powered by As Top up BD", font=get_card_font(18), fill=CARD_MUTED_COLOR, anchor='mm')
+    
+    return finish_card(card, overlay)
+
+# Rendered profile cards: (uid, profile hash) -> {'png': bytes, 'photo': uploaded photo or None},
+# least recently used first
+card_cache = OrderedDict()
+
+# Cards being rendered, so concurrent identical requests share one render
+pending_cards = {}
+
+card_metrics = {
+    'hits': 0,
+    'renders': 0,
+    'uploads_reused': 0
+}
+
+async def get_profile_card(uid, data):
+    """Profile card cache entry, served from cache when the profile hasn't changed"""
+    profile_hash = hashlib.sha1(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()
+    key = (uid, profile_hash)
+    
+    entry = card_cache.get(key)
+    if entry is not None:
+        card_cache.move_to_end(key)
+        card_metrics['hits'] += 1
+        return entry
+    
+    task = pending_cards.get(key)
+    if task is None:
+        card_metrics['renders'] += 1
+        task = asyncio.ensure_future(run_in_render_pool(render_profile_card, data))
+        pending_cards[key] = task
+        task.add_done_callback(lambda _: pending_cards.pop(key, None))
+    
+    card = await asyncio.shield(task)
+    entry = card_cache.setdefault(key, {'png': card, 'photo': None})
+    while len(card_cache) > CARD_CACHE_SIZE:
+        card_cache.popitem(last=False)
+    return entry
+
+async def send_profile_card(event, uid, data):
+    """Reply with a profile card, reusing the uploaded photo when the card was sent before"""
+    entry = await get_profile_card(uid, data)
+    
+    if entry['photo'] is not None:
+        try:
+            await event.reply(file=entry['photo'])
+            card_metrics['uploads_reused'] += 1
+            return
+        except Exception as e:
+            # e.g. an expired file reference, fall back to uploading again
+            logging.warning("Cached Card Upload Error: {}".format(e))
+            entry['photo'] = None
+    
+    sent = await event.reply(file=make_document(entry['png'], "card_{}.png".format(uid)))
+    entry['photo'] = getattr(sent, 'photo', None)
+
+async def send_receipt_card(event, order_data):
+    """Reply with a receipt card, errors are logged and don't affect the order"""
+    if not RECEIPT_CARDS:
+        return
+    try:
+        card = await run_in_render_pool(render_receipt_card, order_data)
+        await event.reply(file=make_document(card, "receipt_{}.png".format(order_data.get('order_id', 'order'))))
+    except Exception as e:
+        logging.error("Receipt Card Error: {}".format(e))
+
 # Authorization checker
 async def is_authorized(event):
     """Check if user and chat are authorized"""
     user_id = event.sender_id
     chat_id = event.chat_id
     
-    # Get bot owner ID
-    me = await client.get_me()
-    owner_id = me.id
+    # Get bot owner ID (cached on startup, since get_me() is a request to Telegram)
+    owner_id = bot_owner_id
+    if owner_id is None:
+        me = await client.get_me()
+        owner_id = me.id
     
     # Owner always has access everywhere
     if user_id == owner_id:
@@ -325,16 +814,126 @@ async def is_authorized(event):
     
     return False
 
+# ================ QUOTAS ================
+
+# Token buckets: key -> [tokens, last refill time]
+quota_buckets = {}
+
+# Recent commands for dedupe: (chat_id, text) -> time, oldest first
+recent_commands = OrderedDict()
+
+# Commands that start a conversation are per user, so they are never deduped
+DEDUPE_EXEMPT_COMMANDS = ('tp', 'gor')
+
+# Last "slow down" / "not authorized" reply per user
+quota_notices = {}
+
+quota_metrics = {
+    'rejected': 0,
+    'deduped': 0
+}
+
+# Bot owner ID (set on startup, owner is exempt from quotas)
+bot_owner_id = None
+
+def bucket_has_token(key, quota, now):
+    """Refill a bucket and check it has a token, without consuming it"""
+    capacity, rate = quota
+    bucket = quota_buckets.get(key)
+    if bucket is None:
+        bucket = quota_buckets[key] = [capacity, now]
+    else:
+        bucket[0] = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+    return bucket[0] >= 1
+
+def is_duplicate_command(chat_id, text, now):
+    """Check for an identical command in the same chat within DEDUPE_WINDOW"""
+    # Drop expired entries from the front, amortized O(1)
+    while recent_commands:
+        oldest_time = next(iter(recent_commands.values()))
+        if now - oldest_time < DEDUPE_WINDOW:
+            break
+        recent_commands.popitem(last=False)
+    
+    return (chat_id, text.strip().lower()) in recent_commands
+
+def remember_command(chat_id, text, now):
+    """Record an answered command for dedupe"""
+    recent_commands[(chat_id, text.strip().lower())] = now
+
+def forget_command(event):
+    """Drop a command's dedupe entry when it failed, so a retry gets answered"""
+    text = event.message.text or ""
+    recent_commands.pop((event.chat_id, text.strip().lower()), None)
+
+def should_send_notice(user_id, now):
+    """Allow one notice reply per user per QUOTA_NOTICE_INTERVAL"""
+    last_notice = quota_notices.get(user_id)
+    if last_notice is not None and now - last_notice < QUOTA_NOTICE_INTERVAL:
+        return False
+    quota_notices[user_id] = now
+    return True
+
+async def reply_unauthorized(event):
+    """Reply to an unauthorized sender, at most once per QUOTA_NOTICE_INTERVAL"""
+    if should_send_notice(event.sender_id, time.monotonic()):
+        await event.reply("```\n❌ You are not authorized to use this bot.\n```")
+
+async def check_quota(event, command):
+    """Check dedupe and token-bucket quotas for a command, True if it may run"""
+    user_id = event.sender_id
+    if user_id == bot_owner_id:
+        return True
+    
+    now = time.monotonic()
+    text = event.message.text or ""
+    dedupe = DEDUPE_WINDOW > 0 and command not in DEDUPE_EXEMPT_COMMANDS
+    
+    if dedupe and is_duplicate_command(event.chat_id, text, now):
+        quota_metrics['deduped'] += 1
+        return False
+    
+    checks = []
+    if user_quota:
+        checks.append((('user', user_id), user_quota))
+    if chat_quota:
+        checks.append((('chat', event.chat_id), chat_quota))
+    if command in command_quotas:
+        checks.append((('cmd', command, user_id), command_quotas[command]))
+    
+    # Only consume tokens when every bucket allows the command
+    if all(bucket_has_token(key, quota, now) for key, quota in checks):
+        for key, quota in checks:
+            quota_buckets[key][0] -= 1
+        # Only commands that will be answered count as seen
+        if dedupe:
+            remember_command(event.chat_id, text, now)
+        return True
+    
+    quota_metrics['rejected'] += 1
+    
+    # Tell the user once per interval instead of answering every spammed command
+    if should_send_notice(user_id, now):
+        await event.reply("```\n⏳ Slow down! Too many commands, try again in a bit.\n```")
+    return False
+
 # Conversation storage
 user_conversations = {}
 
+# Processed receipts (most recent RECEIPT_HISTORY_LIMIT, used by .export)
+receipt_history = deque(maxlen=RECEIPT_HISTORY_LIMIT)
+
 # ================ COMMANDS ================
 
 @client.on(events.NewMessage(pattern=r'(?i)^\.Cid\s+(\d+)$'))
 async def cid_command(event):
     # Check authorization
     if not await is_authorized(event):
-        await event.reply("```\n❌ You are not authorized to use this bot.\n```")
+        await reply_unauthorized(event)
+        return
+    
+    if not await check_quota(event, 'cid'):
         return
     
     try:
@@ -345,10 +944,12 @@ async def cid_command(event):
         data = fetch_player_data(uid)
         
         if data is None:
+            forget_command(event)
             await processing_msg.edit("```\nError: Unable to fetch data from API.\n```")
             return
         
         if "error" in data or "basicinfo" not in data:
+            forget_command(event)
             await processing_msg.edit("```\nError: Player not found. UID: {}\n```".format(uid))
             return
         
@@ -358,13 +959,17 @@ async def cid_command(event):
         
     except Exception as e:
         logging.error("Command Error: {}".format(e))
+        forget_command(event)
         await event.reply("```\nError: {}\n```".format(str(e)))
 
 @client.on(events.NewMessage(pattern=r'(?i)^\.cd$'))
 async def chatid_command(event):
     """Get chat ID or user details"""
     if not await is_authorized(event):
-        await event.reply("```\n❌ You are not authorized to use this bot.\n```")
+        await reply_unauthorized(event)
+        return
+    
+    if not await check_quota(event, 'cd'):
         return
     
     try:
@@ -423,12 +1028,16 @@ async def chatid_command(event):
         
     except Exception as e:
         logging.error("Chat ID Command Error: {}".format(e))
+        forget_command(event)
         await event.reply("```\nError: {}\n```".format(str(e)))
 
 @client.on(events.NewMessage(pattern=r'(?i)^\.ping$'))
 async def ping_command(event):
     if not await is_authorized(event):
-        await event.reply("```\n❌ You are not authorized to use this bot.\n```")
+        await reply_unauthorized(event)
+        return
+    
+    if not await check_quota(event, 'ping'):
         return
     
     await event.reply("```\n🏓 Pong! Bot is alive!\n```")
@@ -436,7 +1045,10 @@ async def ping_command(event):
 @client.on(events.NewMessage(pattern=r'(?i)^\.help$'))
 async def help_command(event):
     if not await is_authorized(event):
-        await event.reply("```\n❌ You are not authorized to use this bot.\n```")
+        await reply_unauthorized(event)
+        return
+    
+    if not await check_quota(event, 'help'):
         return
     
     help_lines = []
@@ -455,6 +1067,18 @@ async def help_command(event):
     help_lines.append(".gor")
     help_lines.append("  → Process general order")
     help_lines.append("")
+    help_lines.append(".card [UID]")
+    help_lines.append("  → Get player profile as an image card")
+    help_lines.append("  → Example: .card 2716319203")
+    help_lines.append("")
+    help_lines.append(".bcid [UID] [UID] ...")
+    help_lines.append("  → Get many player profiles as a file")
+    help_lines.append("  → Example: .bcid 2716319203 1234567890")
+    help_lines.append("")
+    help_lines.append(".export [csv|txt]")
+    help_lines.append("  → Export processed receipts as a file")
+    help_lines.append("  → Receipt chat or Saved Messages only")
+    help_lines.append("")
     help_lines.append(".cd")
     help_lines.append("  → Get chat/user ID details")
     help_lines.append("")
@@ -466,13 +1090,164 @@ async def help_command(event):
     help_lines.append("```")
     await event.reply("\n".join(help_lines))
 
+@client.on(events.NewMessage(pattern=r'(?i)^\.card\s+(\d+)$'))
+async def card_command(event):
+    """Player profile as an image card"""
+    if not await is_authorized(event):
+        await reply_unauthorized(event)
+        return
+    
+    if not await check_quota(event, 'card'):
+        return
+    
+    try:
+        uid = event.pattern_match.group(1)
+        
+        processing_msg = await event.reply("🎨 Creating player card...")
+        
+        loop = asyncio.get_running_loop()
+        data = await loop.run_in_executor(None, fetch_player_data, uid)
+        
+        if data is None:
+            forget_command(event)
+            await processing_msg.edit("```\nError: Unable to fetch data from API.\n```")
+            return
+        
+        if "error" in data or "basicinfo" not in data:
+            forget_command(event)
+            await processing_msg.edit("```\nError: Player not found. UID: {}\n```".format(uid))
+            return
+        
+        await send_profile_card(event, uid, data)
+        await processing_msg.delete()
+        
+    except Exception as e:
+        logging.error("Card Command Error: {}".format(e))
+        forget_command(event)
+        await event.reply("```\nError: {}\n```".format(str(e)))
+
+# ================ BATCH COMMANDS ================
+
+@client.on(events.NewMessage(pattern=r'(?i)^\.bcid\s+([\d\s,]+)$'))
+async def bcid_command(event):
+    """Batch profile lookup, returned as a document"""
+    if not await is_authorized(event):
+        await reply_unauthorized(event)
+        return
+    
+    if not await check_quota(event, 'bcid'):
+        return
+    
+    try:
+        uids = [uid for uid in event.pattern_match.group(1).replace(",", " ").split() if uid]
+        # Drop duplicates but keep order
+        uids = list(dict.fromkeys(uids))
+        
+        if len(uids) > BATCH_MAX_UIDS:
+            forget_command(event)
+            await event.reply("```\n❌ Error: Too many UIDs ({}). Max is {}.\n```".format(len(uids), BATCH_MAX_UIDS))
+            return
+        
+        progress_msg = await event.reply("🔍 Fetching {} player profiles...".format(len(uids)))
+        loop = asyncio.get_running_loop()
+        
+        rendered = []
+        failed = []
+        last_edit = time.monotonic()
+        
+        for start in range(0, len(uids), BATCH_CHUNK_SIZE):
+            chunk = uids[start:start + BATCH_CHUNK_SIZE]
+            
+            # fetch_player_data blocks, so run the chunk on the default thread pool
+            results = await asyncio.gather(*[loop.run_in_executor(None, fetch_player_data, uid) for uid in chunk])
+            
+            profiles = []
+            for uid, data in zip(chunk, results):
+                if data is None or "error" in data or "basicinfo" not in data:
+                    failed.append(uid)
+                else:
+                    profiles.append(data)
+            
+            if profiles:
+                rendered.append(await run_in_render_pool(render_profiles_chunk, profiles))
+            
+            done = start + len(chunk)
+            if done < len(uids) and time.monotonic() - last_edit >= PROGRESS_EDIT_INTERVAL:
+                await edit_progress(progress_msg, "⏳ Processed {}/{} profiles...".format(done, len(uids)))
+                last_edit = time.monotonic()
+        
+        if not rendered:
+            forget_command(event)
+            await edit_progress(progress_msg, "```\nError: No player data found.\n```")
+            return
+        
+        content = "\n\n".join(rendered)
+        if failed:
+            content += "\n\nFailed UIDs: {}".format(", ".join(failed))
+        
+        caption = "✅ {} profiles fetched".format(len(uids) - len(failed))
+        if failed:
+            caption += ", {} failed".format(len(failed))
+        
+        await event.reply(caption, file=make_document(content.encode('utf-8'), "profiles.txt"), force_document=True)
+        await edit_progress(progress_msg, "✅ Done! Processed {}/{} profiles.".format(len(uids), len(uids)))
+        
+    except Exception as e:
+        logging.error("Batch Command Error: {}".format(e))
+        forget_command(event)
+        await event.reply("```\nError: {}\n```".format(str(e)))
+
+@client.on(events.NewMessage(pattern=r'(?i)^\.export(?:\s+(csv|txt))?$'))
+async def export_command(event):
+    """Export processed receipts as a document"""
+    if not await is_authorized(event):
+        await reply_unauthorized(event)
+        return
+    
+    # Receipts include UniPin codes and bKash Trx IDs, which only the receipt chat may see
+    if event.chat_id != RECEIPT_CHAT_ID and event.chat_id != bot_owner_id:
+        await event.reply("```\n❌ Exports are only available in the receipt chat or Saved Messages.\n```")
+        return
+    
+    if not await check_quota(event, 'export'):
+        return
+    
+    try:
+        export_format = (event.pattern_match.group(1) or "csv").lower()
+        
+        if not receipt_history:
+            forget_command(event)
+            await event.reply("```\n❌ No receipts to export yet.\n```")
+            return
+        
+        # Snapshot so new orders don't change the deque while the pool works
+        receipts = list(receipt_history)
+        progress_msg = await event.reply("⏳ Building {} export of {} receipts...".format(export_format.upper(), len(receipts)))
+        
+        if export_format == "txt":
+            data = await run_in_render_pool(build_receipts_report, receipts)
+        else:
+            data = await run_in_render_pool(build_receipts_csv, receipts)
+        
+        filename = "receipts_{}.{}".format(datetime.utcnow().strftime('%Y%m%d_%H%M%S'), export_format)
+        await event.reply("✅ {} receipts exported".format(len(receipts)), file=make_document(data, filename), force_document=True)
+        await edit_progress(progress_msg, "✅ Export ready!")
+        
+    except Exception as e:
+        logging.error("Export Command Error: {}".format(e))
+        forget_command(event)
+        await event.reply("```\nError: {}\n```".format(str(e)))
+
 # ================ TOP-UP COMMAND ================
 
 @client.on(events.NewMessage(pattern=r'(?i)^\.tp\s+(\d+)$'))
 async def tp_command(event):
     """Top-up command"""
     if not await is_authorized(event):
-        await event.reply("```\n❌ You are not authorized to use this bot.\n```")
+        await reply_unauthorized(event)
+        return
+    
+    if not await check_quota(event, 'tp'):
         return
     
     try:
@@ -508,7 +1283,10 @@ async def tp_command(event):
 async def gor_command(event):
     """General order command"""
     if not await is_authorized(event):
-        await event.reply("```\n❌ You are not authorized to use this bot.\n```")
+        await reply_unauthorized(event)
+        return
+    
+    if not await check_quota(event, 'gor'):
         return
     
     try:
@@ -617,16 +1395,19 @@ async def handle_conversations(event):
                 
                 receipt = format_order_receipt(order_data)
                 
+                # End the conversation before awaiting, so a repeated 'y' can't submit the order twice
+                del user_conversations[user_id]
+                
                 # Forward to receipt group
                 try:
                     await client.send_message(RECEIPT_CHAT_ID, receipt)
+                    receipt_history.append(dict(order_data, type='tp'))
                     await event.reply("```\n✅ Order processed successfully!\n```")
                     logging.info("Receipt forwarded to group")
+                    await send_receipt_card(event, order_data)
                 except Exception as e:
                     await event.reply("```\n❌ Error forwarding receipt: {}\n```".format(str(e)))
                     logging.error("Error forwarding receipt: {}".format(e))
-                
-                del user_conversations[user_id]
             return
         
         # ============ GOR FLOW ============
@@ -691,22 +1472,74 @@ async def handle_conversations(event):
             
             receipt = format_gor_receipt(order_data)
             
+            # End the conversation before awaiting, so further messages can't submit the order twice
+            del user_conversations[user_id]
+            
             # Forward to RECEIPT group
             try:
                 await client.send_message(RECEIPT_CHAT_ID, receipt)
+                receipt_history.append(dict(order_data, type='gor'))
                 await event.reply("```\n✅ Order processed successfully!\n```")
                 logging.info("GOR Receipt forwarded to receipt group")
+                await send_receipt_card(event, order_data)
             except Exception as e:
                 await event.reply("```\n❌ Error forwarding receipt: {}\n```".format(str(e)))
                 logging.error("Error forwarding GOR receipt: {}".format(e))
-            
-            del user_conversations[user_id]
             return
         
     except Exception as e:
         logging.error("Conversation Error: {}".format(e))
 
+def reconnect_delay(attempt):
+    """Exponential backoff with full jitter"""
+    delay = min(RECONNECT_MAX_DELAY, RECONNECT_BASE_DELAY * (2 ** attempt))
+    return random.uniform(0, delay)
+
+async def run_supervised():
+    """Keep the client running, reconnecting with backoff when Telegram drops us"""
+    attempt = 0
+    connected_at = None
+    while True:
+        try:
+            if not client.is_connected():
+                await client.connect()
+                
+                if not await client.is_user_authorized():
+                    logging.error("Session was revoked while reconnecting!")
+                    sys.exit(1)
+                
+                mark_reconnected()
+                logging.info("Reconnected to Telegram (reconnect #{})".format(connection_metrics['reconnect_count']))
+            
+            connected_at = time.monotonic()
+            await client.run_until_disconnected()
+            mark_disconnected("Disconnected by server")
+            logging.warning("Disconnected from Telegram")
+        except (AuthKeyError, UnauthorizedError) as e:
+            logging.error("Session is no longer authorized: {}".format(e))
+            sys.exit(1)
+        except Exception as e:
+            # Includes errors from the update loop (e.g. RPC errors while catching up)
+            mark_disconnected(e)
+            logging.warning("Connection Error: {}".format(e))
+            if client.is_connected():
+                try:
+                    await client.disconnect()
+                except Exception as disconnect_error:
+                    logging.warning("Disconnect Error: {}".format(disconnect_error))
+        
+        # Only reset the backoff once a connection has stayed up for a while
+        if connected_at is not None and time.monotonic() - connected_at >= RECONNECT_STABLE_AFTER:
+            attempt = 0
+        connected_at = None
+        
+        delay = reconnect_delay(attempt)
+        attempt += 1
+        logging.info("Reconnecting in {:.1f}s (attempt {})".format(delay, attempt))
+        await asyncio.sleep(delay)
+
 async def main():
+    global bot_owner_id
     try:
         # Connect to Telegram
         await client.connect()
@@ -718,6 +1551,7 @@ async def main():
             sys.exit(1)
         
         me = await client.get_me()
+        bot_owner_id = me.id
         logging.info("Userbot started successfully!")
         logging.info("User: {} (@{})".format(me.first_name, me.username if me.username else "No username"))
         logging.info("ID: {}".format(me.id))
@@ -725,10 +1559,10 @@ async def main():
         logging.info("Authorized Groups: {}".format(authorized_group_ids if authorized_group_ids else "None"))
         logging.info("Receipt Chat ID: {}".format(RECEIPT_CHAT_ID))
         logging.info("Topup Link: {}".format(TOPUP_LINK))
-        logging.info("Ready! Commands: .Cid, .tp, .gor, .cd, .ping, .help")
+        logging.info("Ready! Commands: .Cid, .card, .bcid, .tp, .gor, .export, .cd, .ping, .help")
         
-        # Keep the client running
-        await client.run_until_disconnected()
+        # Keep the client running, reconnecting on drops
+        await run_supervised()
         
     except Exception as e:
         logging.error("Start Error: {}".format(e))